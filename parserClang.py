@@ -3,6 +3,7 @@
 # (*) Installation:
 #
 # pip3 install clang
+# pip3 install orjson (optional, faster json output)
 #
 # On Linux:
 #   cd /usr/lib/x86_64-linux-gnu/
@@ -26,148 +27,507 @@ import getopt
 import os
 import sys
 import json
+import hashlib
+import tempfile
+import shutil
+import atexit
+import glob
 import clang.cindex
 import clang
 import argparse
 import platform
+import multiprocessing
+from ctypes import byref, cast, c_void_p, POINTER
 from clang.cindex import CursorKind
-from collections import defaultdict
+from clang.cindex import conf, callbacks, SourceLocation
+from clang.cindex import CompilationDatabase, CompilationDatabaseError
+from clang.cindex import TranslationUnit
+from clang.cindex import TranslationUnitLoadError, TranslationUnitSaveError
+from clang.cindex import Diagnostic
+from collections import defaultdict, Counter
+
+try:
+    import orjson # Faster json serialization (optional)
+except ImportError:
+    orjson = None
 
 MAC_CLANG = "/Applications/Xcode.app/Contents/Frameworks/libclang.dylib"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "parserClang")
+
+# Values returned by a clang_visitChildren visitor (CXChildVisitResult)
+CHILD_VISIT_CONTINUE = 1
+CHILD_VISIT_RECURSE = 2
+
+# Default parsing arguments (tokenized once)
+CPP_ARGS = ('-x', 'c++', '--std=c++11')
+C_ARGS = ()
+
+# Compiler options followed by a path (joined or as the next argument),
+# the longest first when an option is a prefix of another one
+PATH_OPTIONS = ('-include-pch', '-include', '-imacros', '-isystem',
+                '-isysroot', '-iquote', '-idirafter', '-I', '-F', '--sysroot=')
+
+# Extensions of the parsed files
+EXTS_CPP = ('.cpp', '.hpp', '.cc')
+EXTS_C = ('.c', '.h', '.hh')
+EXTS_ALL = EXTS_CPP + EXTS_C
+# Folders which are never walked
+SKIPPED_DIRS = {'.git', '.hg', '.svn', 'build', 'node_modules'}
 
 verbose = False # Change it to verbose mode
 silent = False #
-
-global_funcs = defaultdict(list)
-global_calls = defaultdict(list)
+cache_dir = None # Folder of the saved ASTs (None to disable the cache)
+index = None # clang Index shared by all the files parsed by a process
+pch_header = None # Header precompiled and included in every parsed file
+pch_args = dict() # parsing arguments -> arguments to include the PCH
+pch_dir = None # Folder of the PCHs built by this run (without cache)
+get_expansion_file = None # libclang function (see get_expansion_file_func)
+
+# Number of occurrences and files of each function (declarations/calls)
+global_func_counts = Counter()
+global_func_files = defaultdict(set)
+global_call_counts = Counter()
+global_call_files = defaultdict(set)
+
+# Filtered function names (displayname -> interned name)
+func_names = dict()
 
 # Check if a path is a directory or a file
-def check_input_path(path, includePaths):
+def check_input_path(path, includePaths, compdb, jobs):
     if os.path.isdir(path):
-        iterate_root_folder(path, includePaths)
+        iterate_root_folder(path, includePaths, compdb, jobs)
     elif os.path.isfile(path):
-        check_type_file(path, includePaths)
+        arguments = check_type_file(path, includePaths, compdb)
+        if arguments is not None:
+            merge_results(parse_file(path, arguments))
     else:
         sys.stderr("[WARNING] Unable to analyse this file: " + path)
 
+# Retrieve the include paths as a tuple of arguments
 def get_include_paths(rootdir, includepathsFile):
     paths = []
     with open(includepathsFile, 'r') as file:
         for includePath in file.readlines():
-            path = '-isystem ' + rootdir + includePath.replace('\n', '')
-            paths.append(path)
-
-    return ' '.join(paths)
-
-# Check type/extension of a given file
-def check_type_file(filepath, includePaths):
-    cplusplusOptions = '-x c++ --std=c++11'
-    cOptions = ''
-
-    if includePaths is not None:
-        cplusplusOptions = cplusplusOptions + ' ' + includePaths
-        cOptions = cOptions + ' ' + includePaths
+            paths.append('-isystem')
+            paths.append(rootdir + includePath.replace('\n', ''))
+
+    return tuple(paths)
+
+# Load the compilation database (compile_commands.json) of a folder
+# (None if there is none)
+def get_compilation_database(folder):
+    if not os.path.isfile(os.path.join(folder, 'compile_commands.json')):
+        return None
+    try:
+        return CompilationDatabase.fromDirectory(folder)
+    except CompilationDatabaseError:
+        return None
+
+# Retrieve the arguments used to compile a file from the compilation
+# database (without the compiler, the input files and the output options).
+# Relative paths are resolved against the directory of the command since
+# libclang resolves them against the current directory.
+def get_compile_arguments(compdb, filepath):
+    filepath = os.path.abspath(filepath)
+    cmds = compdb.getCompileCommands(filepath)
+    if not cmds:
+        return None
+
+    directory = cmds[0].directory
+    def resolve(path):
+        return os.path.normpath(os.path.join(directory, path))
+
+    args = []
+    arguments = iter(cmds[0].arguments)
+    next(arguments, None)
+    for arg in arguments:
+        if arg == '--':
+            # only input files follow
+            break
+        elif arg == '-o':
+            next(arguments, None)
+        elif arg == '-c':
+            continue
+        elif arg in PATH_OPTIONS:
+            args.append(arg)
+            path = next(arguments, None)
+            if path is not None:
+                args.append(resolve(path))
+        elif arg.startswith(PATH_OPTIONS):
+            option = next(o for o in PATH_OPTIONS if arg.startswith(o))
+            args.append(option + resolve(arg[len(option):]))
+        elif not arg.startswith('-') and resolve(arg) == filepath:
+            continue
+        else:
+            args.append(arg)
+    return tuple(args)
+
+# Check type/extension of a given file and return its parsing arguments
+# as a tuple (None if the file must not be parsed). The options of the
+# compilation database are used when it returns a command for the file
+# (libclang infers one from a similar entry for a file missing from it).
+def check_type_file(filepath, includePaths, compdb):
     if not silent:
         print("Gathering symbols of " + filepath)
     
-    if filepath.endswith(".cpp") or filepath.endswith(".hpp") or filepath.endswith(".cc"):
-        parse_file(filepath, cplusplusOptions)
-    elif filepath.endswith(".c") or filepath.endswith(".h") or filepath.endswith(".hh"):
-        parse_file(filepath, cOptions)
+    if compdb is not None and filepath.endswith(EXTS_ALL):
+        arguments = get_compile_arguments(compdb, filepath)
+        if arguments is not None:
+            return arguments
+
+    if includePaths is None:
+        includePaths = ()
+    if filepath.endswith(EXTS_CPP):
+        arguments = CPP_ARGS + includePaths
+    elif filepath.endswith(EXTS_C):
+        arguments = C_ARGS + includePaths
+    else:
+        return None
+
+    if pch_header is not None and not os.path.samefile(filepath, pch_header):
+        arguments = arguments + get_pch_args(arguments)
+    return arguments
+
+# Retrieve the arguments including the precompiled pch_header for files
+# parsed with the given arguments (the PCH is built once per set of
+# arguments since it must match the language options of the files)
+def get_pch_args(arguments):
+    if arguments not in pch_args:
+        pch_path = build_pch(pch_header, arguments)
+        if pch_path is None:
+            pch_args[arguments] = ()
+        else:
+            pch_args[arguments] = ('-include-pch', pch_path)
+    return pch_args[arguments]
+
+# Precompile a header by saving its AST (parsed as an incomplete TU) and
+# return the path of the PCH (None if the header cannot be precompiled)
+def build_pch(header, arguments):
+    global pch_dir
+    if cache_dir is not None:
+        folder = cache_dir
+    else:
+        # Without cache, the PCH is rebuilt by each run (never reused)
+        if pch_dir is None:
+            pch_dir = tempfile.mkdtemp(prefix='parserClang-')
+            atexit.register(shutil.rmtree, pch_dir, True)
+        folder = pch_dir
+    key = os.path.abspath(header) + repr(arguments)
+    pch_path = os.path.join(folder,
+                            hashlib.sha1(key.encode()).hexdigest() + '.pch')
+    # mtimes of the header and of all the files it includes
+    deps_path = pch_path + '.deps'
+    if os.path.isfile(pch_path) and pch_deps_unchanged(deps_path):
+        return pch_path
+
+    tu = index.parse(header, args=arguments,
+                     options=TranslationUnit.PARSE_INCOMPLETE)
+    # A PCH with errors is rejected by clang when it is included
+    if any(d.severity >= Diagnostic.Error for d in tu.diagnostics):
+        sys.stderr.write("[WARNING] Unable to precompile (errors): " + header + "\n")
+        return None
+    deps = {os.path.abspath(i.include.name) for i in tu.get_includes()}
+    deps.add(os.path.abspath(header))
+    try:
+        os.makedirs(folder, exist_ok=True)
+        tu.save(pch_path)
+        with open(deps_path, 'w') as fp:
+            json.dump({d: os.path.getmtime(d) for d in deps}, fp)
+    except (OSError, TranslationUnitSaveError):
+        sys.stderr.write("[WARNING] Unable to precompile: " + header + "\n")
+        return None
+    return pch_path
+
+# Check that none of the files used to build a PCH changed since
+def pch_deps_unchanged(deps_path):
+    try:
+        with open(deps_path) as fp:
+            deps = json.load(fp)
+        return all(os.path.getmtime(d) == m for d, m in deps.items())
+    except (OSError, ValueError):
+        return False
 
-# Iterate through a root folder
-def iterate_root_folder(rootdir, includePaths):
+# Iterate through a root folder and parse its files in parallel
+def iterate_root_folder(rootdir, includePaths, compdb, jobs):
+    files_args = []
     for subdir, dirs, files in os.walk(rootdir):
+        dirs[:] = [d for d in dirs if d not in SKIPPED_DIRS]
         for file in files:
+            if not file.endswith(EXTS_ALL):
+                continue
             filepath = subdir + os.sep + file
-            check_type_file(filepath, includePaths)
-
-# Print info about symbols (verbose mode)
-def display_info_function(funcs, calls):
-    for f in funcs:
-        print(fully_qualified(f), f.location)
-        for c in calls:
-            if is_function_call(f, c):
-                print('-', c.location)
-        print()
-
-# Parse a given file to generate a AST
+            arguments = check_type_file(filepath, includePaths, compdb)
+            if arguments is not None:
+                files_args.append((filepath, arguments))
+
+    # Biggest files first so that a large file does not start last and
+    # leave the other workers idle (longest processing time scheduling)
+    files_args.sort(key=lambda file_args: os.path.getsize(file_args[0]),
+                    reverse=True)
+
+    with multiprocessing.Pool(jobs, init_worker,
+                              (verbose, silent, cache_dir)) as pool:
+        for results in pool.imap_unordered(parse_file_args, files_args,
+                                           chunksize=1):
+            merge_results(results)
+
+# Set the global state of a worker process (required with "spawn")
+def init_worker(verbose_mode, silent_mode, cache_folder):
+    global verbose, silent, cache_dir, index
+    verbose = verbose_mode
+    silent = silent_mode
+    cache_dir = cache_folder
+    if platform.system() == "Darwin" and not clang.cindex.Config.loaded:
+        clang.cindex.Config.set_library_file(MAC_CLANG)
+    index = clang.cindex.Index.create()
+
+# Parse a (filepath, arguments) tuple (used by the pool of workers)
+def parse_file_args(file_args):
+    return parse_file(*file_args)
+
+# Merge the symbols of a file into the global ones
+def merge_symbols(global_counts, global_files, filename, file_counts):
+    global_counts.update(file_counts)
+    for funcName in file_counts:
+        global_files[funcName].add(filename)
+
+# Merge the (filename, functions, calls, info) of a file into the global
+# ones (info is printed here so the outputs of the workers do not mix)
+def merge_results(results):
+    filename, funcs, calls, info = results
+    if info:
+        print(info)
+    merge_symbols(global_func_counts, global_func_files, filename, funcs)
+    merge_symbols(global_call_counts, global_call_files, filename, calls)
+
+# Build the [count, path1, path2, ...] value of each symbol (sorted by
+# name since the files are merged in an arbitrary order)
+def get_symbols(counts, files):
+    return {funcName: [counts[funcName], *sorted(files[funcName])]
+            for funcName in sorted(counts)}
+
+# Retrieve info about symbols as text (verbose mode)
+def get_info_function(filepath, funcs, calls):
+    # Index the functions by hash so that each call is resolved with a
+    # single get_definition() instead of being compared to every function
+    funcs_by_hash = defaultdict(list)
+    for i, (qualifiedName, f) in enumerate(funcs):
+        funcs_by_hash[f.hash].append(i)
+
+    calls_by_func = defaultdict(list)
+    for c in calls:
+        defn = c.get_definition()
+        if defn is None:
+            continue
+        for i in funcs_by_hash.get(defn.hash, ()):
+            if defn == funcs[i][1]:
+                calls_by_func[i].append(c)
+
+    lines = []
+    for i, (qualifiedName, f) in enumerate(funcs):
+        lines.append(qualifiedName + ' ' + format_location(filepath, f.location))
+        for c in calls_by_func[i]:
+            lines.append('- ' + format_location(filepath, c.location))
+        lines.append('')
+    return '\n'.join(lines)
+
+# Format a location of the parsed file with the path given by the user (a
+# TU loaded from the cache reports absolute file names)
+def format_location(filepath, loc):
+    return "<SourceLocation file %r, line %d, column %d>" % (
+        filepath, loc.line, loc.column)
+
+# Parse a given file (with a tuple of arguments) to generate a AST and
+# return its (filename, functions, calls, info) where info is the verbose
+# output of the file (None if not verbose)
 def parse_file(filepath, arguments):
 
-    idx = clang.cindex.Index.create()
-    args = arguments.split()
-    tu = idx.parse(filepath, args=args)
-    funcs, calls = find_funcs_and_calls(tu)
+    # Function bodies are kept (calls are gathered from them) but headers
+    # are parsed as incomplete translation units: this skips the work done
+    # at the end of a TU (e.g. pending template instantiations)
+    options = 0
+    if filepath.endswith(".h") or filepath.endswith(".hpp") or filepath.endswith(".hh"):
+        options = TranslationUnit.PARSE_INCOMPLETE
+    file_funcs = Counter()
+    file_calls = Counter()
+    try:
+        tu = load_translation_unit(index, filepath, arguments, options)
+    except TranslationUnitLoadError:
+        # an error in a worker would abort the analysis of all the files
+        sys.stderr.write("[WARNING] Unable to parse this file: " + filepath + "\n")
+        return filepath, file_funcs, file_calls, None
+    funcs, calls = find_funcs_and_calls(tu, file_funcs, file_calls)
+    info = None
     if verbose:
-        display_info_function(funcs, calls)
-        print(list(tu.diagnostics))
-
-
-# Retrieve a fully qualified function name (with namespaces)
-def fully_qualified(c):
-    if c is None:
-        return ''
-    elif c.kind == CursorKind.TRANSLATION_UNIT:
-        return ''
-    else:
-        res = fully_qualified(c.semantic_parent)
-        if res != '':
-            return res + '::' + c.spelling
-    return c.spelling
+        info = get_info_function(filepath, funcs, calls) + '\n' + str(list(tu.diagnostics))
+
+    return filepath, file_funcs, file_calls, info
+
+# Load the AST of a file from the cache or parse it (and save it)
+def load_translation_unit(idx, filepath, args, options):
+    if cache_dir is None:
+        return idx.parse(filepath, args=args, options=options)
+
+    # The saved AST of a file is named <sha1 of file/arguments>-<mtime>.ast:
+    # a modified file gets a new name and its previous ASTs are removed.
+    # (libclang itself refuses to load an AST whose headers have changed,
+    # the file is then parsed again)
+    key = os.path.abspath(filepath) + repr(args) + str(options)
+    prefix = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest())
+    ast_path = prefix + '-' + str(os.path.getmtime(filepath)) + '.ast'
+    if os.path.isfile(ast_path):
+        try:
+            return TranslationUnit.from_ast_file(ast_path, idx)
+        except TranslationUnitLoadError:
+            pass
 
-# Determine where a call-expression cursor refers to a particular
-# function declaration
-def is_function_call(funcdecl, c):
-    defn = c.get_definition()
-    return (defn is not None) and (defn == funcdecl)
+    tu = idx.parse(filepath, args=args, options=options)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_path in glob.glob(glob.escape(prefix) + '-*.ast'):
+            os.remove(old_path)
+        tu.save(ast_path)
+    except (OSError, TranslationUnitSaveError):
+        if not silent:
+            sys.stderr.write("[WARNING] Unable to cache the AST of: " + filepath + "\n")
+    return tu
 
 # Filter name to take only the function name (remove "(args)")
 def filter_func_name(displayname):
-    if "(" in displayname:
-        return displayname.split('(')[0]
-    return displayname
-
-# Retrieve lists of function declarations and call expressions in a
-#translation unit
-def find_funcs_and_calls(tu):
-    filename = tu.cursor.spelling
+    funcName = func_names.get(displayname)
+    if funcName is None:
+        if "(" in displayname:
+            funcName = displayname.split('(', 1)[0]
+        else:
+            funcName = displayname
+        # The same names are found many times: share a single string
+        funcName = sys.intern(funcName)
+        func_names[displayname] = funcName
+    return funcName
+
+# Retrieve clang_getExpansionLocation bound to only return the CXFile
+# handle of a location as a plain address (a separate function pointer so
+# that the clang.cindex bindings are not modified)
+def get_expansion_file_func():
+    global get_expansion_file
+    if get_expansion_file is None:
+        get_expansion_file = conf.lib['clang_getExpansionLocation']
+        get_expansion_file.argtypes = [SourceLocation, POINTER(c_void_p),
+                                       c_void_p, c_void_p, c_void_p]
+        get_expansion_file.restype = None
+    return get_expansion_file
+
+# Retrieve the fully qualified name of a function declaration from the
+# names of its enclosing scopes (prefix), or from its semantic parents when
+# they are not its lexical ones (e.g. "int ns::f() {}" defined out of its
+# namespace, friend function defined in a class)
+def get_qualified_name(c, prefix):
+    parent = c.semantic_parent
+    if parent == c.lexical_parent:
+        return '::'.join(prefix + [c.spelling])
+
+    parts = [c.spelling]
+    while parent is not None and parent.kind != CursorKind.TRANSLATION_UNIT:
+        if parent.spelling:
+            parts.append(parent.spelling)
+        parent = parent.semantic_parent
+    return '::'.join(reversed(parts))
+
+# Retrieve lists of function declarations (with their fully qualified
+#name) and call expressions in a translation unit, only kept in verbose
+#mode (and count them into file_funcs/file_calls, all of them being
+#located in the file of the translation unit)
+def find_funcs_and_calls(tu, file_funcs, file_calls):
     calls = []
     funcs = []
-    for c in tu.cursor.walk_preorder():
-        if c.location.file is None:
-            pass
-        elif c.location.file.name != filename:
-            pass
-        elif c.kind == CursorKind.CALL_EXPR:
-            calls.append(c)
+
+    # Bindings looked up once outside of the visitor
+    lib = conf.lib
+    getCursorLocation = lib.clang_getCursorLocation
+    getExpansionFile = get_expansion_file_func()
+    CALL_EXPR = CursorKind.CALL_EXPR.value
+    FUNCTION_DECL = CursorKind.FUNCTION_DECL.value
+    NAMESPACE = CursorKind.NAMESPACE.value
+    SCOPES = {NAMESPACE, CursorKind.CLASS_DECL.value,
+              CursorKind.STRUCT_DECL.value, CursorKind.CLASS_TEMPLATE.value}
+    visitChildren = lib.clang_visitChildren
+    calls_append = calls.append
+    funcs_append = funcs.append
+    # the cursors (and names) are only needed to display them
+    keep = verbose
+
+    # Files are compared by their libclang handle instead of their name
+    main_file = cast(lib.clang_getFile(tu, tu.cursor.spelling), c_void_p).value
+    loc_file = c_void_p()
+    loc_file_ref = byref(loc_file)
+
+    # Only the subtrees of the parsed file are visited: a cursor from
+    # another file (e.g. an included header) is skipped with its children
+    # unless it is a namespace which may hold cursors of the parsed file.
+    # The AST is walked by clang_visitChildren itself (no Python recursion
+    # nor list of children) and only the kind of a cursor and a single
+    # libclang call (the file of its expansion location) are needed before
+    # deciding to descend into it.
+    #
+    # In verbose mode, the names of the enclosing namespaces/classes are
+    # kept in a stack while their children are visited, so the qualified
+    # name of a function usually does not require to walk its semantic
+    # parents (see get_qualified_name).
+    prefix = []
+
+    def visitor(c, parent, data):
+        kind = c._kind_id
+        # the expansion location is used so that the cursors produced by a
+        # macro used in the parsed file are part of it
+        getExpansionFile(getCursorLocation(c), loc_file_ref, None, None, None)
+        if loc_file.value != main_file:
+            if kind != NAMESPACE:
+                return CHILD_VISIT_CONTINUE
+            # a namespace opened in another file (e.g. an included
+            # "namespace foo {") may hold cursors of the parsed file
+            if keep:
+                return visit_scope(c)
+            return CHILD_VISIT_RECURSE
+
+        if kind == CALL_EXPR:
+            if keep:
+                # keep a reference to the TU as Cursor.get_children() does
+                c._tu = tu
+                calls_append(c)
             # filter name to take only the name if necessary
             funcName = filter_func_name(c.displayname)
             
             #increment counter
-            if funcName not in global_calls:
-                global_calls[funcName].append(1)
-            else:
-                global_calls[funcName][0] +=1
-
-            #add path to file
-            if c.location.file.name not in global_calls[funcName]:
-                global_calls[funcName].append(c.location.file.name)
+            file_calls[funcName] += 1
 
-        elif c.kind == CursorKind.FUNCTION_DECL:
-            funcs.append(c)
+        elif kind == FUNCTION_DECL:
+            if keep:
+                c._tu = tu
+                funcs_append((get_qualified_name(c, prefix), c))
             # filter name to take only the name if necessary
             funcName = filter_func_name(c.displayname)
             
             #increment counter
-            if funcName not in global_funcs:
-                global_funcs[funcName].append(1)
-            else:
-                global_funcs[funcName][0] +=1
-
-            #add path to file
-            if c.location.file.name not in global_funcs[funcName]:
-                global_funcs[funcName].append(c.location.file.name)
-
+            file_funcs[funcName] += 1
+
+        if keep and kind in SCOPES:
+            return visit_scope(c)
+
+        return CHILD_VISIT_RECURSE
+
+    # Visit the children of a namespace/class with its name in the stack
+    # (visited here to know when the scope is left)
+    def visit_scope(c):
+        spelling = c.spelling
+        if spelling:
+            prefix.append(spelling)
+        visitChildren(c, visit, None)
+        if spelling:
+            prefix.pop()
+        return CHILD_VISIT_CONTINUE
+
+    visit = callbacks['cursor_visit'](visitor)
+    visitChildren(tu.cursor, visit, None)
     return funcs, calls
 
 # str2bool is used for boolean arguments parsing.
@@ -181,10 +541,17 @@ def str2bool(v):
     else:
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
+# Write data to a binary file object as json (with orjson if available)
+def dump_json(data, fp):
+    if orjson is not None:
+        fp.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    else:
+        fp.write(json.dumps(data, indent=2, sort_keys=True).encode())
+
 # Write data to json file
 def write_to_json(output_filename, data):
-    with open(output_filename + '.json', 'w') as fp:
-        json.dump(data, fp, indent=4, sort_keys=True)
+    with open(output_filename + '.json', 'wb') as fp:
+        dump_json(data, fp)
 
 # Open data to json file
 def read_from_json(filename):
@@ -192,45 +559,49 @@ def read_from_json(filename):
         data = json.load(fp)
     return data
 
-# Read the list of syscalls (json file)
+# Read the list of syscalls (json file) as a set of names
 def read_syscalls_list(filename):
     with open(filename) as f:
-        return json.load(f)
+        return set(json.load(f))
 
 
 # Check which syscall is a function
-def compare_syscalls(syscalls):
+def compare_syscalls(syscalls, global_funcs, global_calls):
     if not silent:
         print("Gathered syscalls from function calls")
 
-    called_syscalls = defaultdict(list)
-    define_syscalls = defaultdict(list)
-
-    for key, value in global_calls.items():
-        if key in syscalls:
-            if verbose:
-                print(key, end=", ");
-                print(global_calls[key])
-            called_syscalls[key] = value
-
-    for key, value in global_funcs.items():
-        if key in syscalls:
-            if verbose:
-                print(key, end=", ");
-                print(global_funcs[key])
-            define_syscalls[key] = value
+    matched_calls = sorted(global_calls.keys() & syscalls)
+    matched_funcs = sorted(global_funcs.keys() & syscalls)
+
+    if verbose:
+        for key in matched_calls:
+            print(key, end=", ");
+            print(global_calls[key])
+        for key in matched_funcs:
+            print(key, end=", ");
+            print(global_funcs[key])
+
+    called_syscalls = {key: global_calls[key] for key in matched_calls}
+    define_syscalls = {key: global_funcs[key] for key in matched_funcs}
     
     return (called_syscalls, define_syscalls)
 
 def main():
-    global silent, verbose
+    global silent, verbose, cache_dir, index, pch_header
 
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--folder','-f', help='Path to the folder to analyse', required=True)
     parser.add_argument('--include','-i', help='Path to the includepathsFile')
+    parser.add_argument('--compdb', '-c', help='Path to the folder containing compile_commands.json (default=the analysed folder)')
+    parser.add_argument('--pch-header', help='Header (e.g. a project config header) precompiled once and included in every file parsed with the default options')
     parser.add_argument('--output', '-o', help='Path to the output resulting json file', default="out.json")
     parser.add_argument('--syscalls','-s', help='Path to the syscalls file', default="syscalls.json")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Number of files parsed in parallel (default=number of CPUs)')
+    parser.add_argument('--cache', type=str2bool,
+                        nargs='?', const=True, default=False,
+                        help='Save/reuse the parsed ASTs in ' + CACHE_DIR + ' (default=False)')
     parser.add_argument('--verbose', '-v', type=str2bool, 
                         nargs='?', const=True, default=False,
                         help='Verbose mode')
@@ -241,13 +612,29 @@ def main():
 
     verbose = args.verbose
     silent = args.silent
+    if args.cache:
+        cache_dir = CACHE_DIR
+    index = clang.cindex.Index.create()
+    if args.pch_header is not None:
+        if os.path.isfile(args.pch_header):
+            pch_header = args.pch_header
+        else:
+            sys.stderr.write("[WARNING] Unable to find the PCH header: " + args.pch_header + "\n")
+
+    compdb = None
+    if args.compdb is not None:
+        compdb = get_compilation_database(args.compdb)
+        if compdb is None:
+            sys.stderr.write("[WARNING] No compile_commands.json in: " + args.compdb + "\n")
+    elif os.path.isdir(args.folder):
+        compdb = get_compilation_database(args.folder)
 
     if args.include is not None:
         includePaths = get_include_paths(args.folder, args.include)
-        print(includePaths)
-        check_input_path(args.folder, includePaths)
+        print(' '.join(includePaths))
+        check_input_path(args.folder, includePaths, compdb, args.jobs)
     else:
-        check_input_path(args.folder, None)
+        check_input_path(args.folder, None, compdb, args.jobs)
 
     if not silent:
         print("---------------------------------------------------------")
@@ -258,22 +645,23 @@ def main():
             'called_syscalls':'',
             'define_syscalls':'',
         }
+    global_funcs = get_symbols(global_func_counts, global_func_files)
+    global_calls = get_symbols(global_call_counts, global_call_files)
     output_dict['functions'] = [{'name':key, 'value':value} for key,value in global_funcs.items()]
     output_dict['calls'] = [{'name':key, 'value':value} for key,value in global_calls.items()]
 
     # Read syscalls from txt file
     syscalls = read_syscalls_list(args.syscalls)
     # Compare syscalls list with function declarations/calls
-    (called_syscalls, define_syscalls) = compare_syscalls(syscalls)
+    (called_syscalls, define_syscalls) = compare_syscalls(syscalls, global_funcs, global_calls)
     output_dict['called_syscalls'] = called_syscalls
     output_dict['define_syscalls'] = define_syscalls
         
     if args.output is None:
-        output_file = sys.stdout
+        dump_json(output_dict, sys.stdout.buffer)
     else:
-        output_file = open(args.output, "w")
-        
-    json.dump(output_dict, output_file, sort_keys=True, indent=4)
+        with open(args.output, "wb") as output_file:
+            dump_json(output_dict, output_file)
 
 
 if __name__== "__main__":